@@ -6,6 +6,7 @@ import re
 import base64
 import time
 import redis
+from sandbox_pool import SandboxPool
 
 r = redis.StrictRedis(host='redis', port=6379, decode_responses=True)
 
@@ -60,6 +61,14 @@ LANGUAGE_CONFIG = {
 }
 
 
+# Extra seconds given to a `docker exec` on top of the test's own timeout
+SANDBOX_EXEC_GRACE = 2
+# Reference solutions are trusted, but still should not hang a worker forever
+REFERENCE_TIMEOUT = 10
+
+_sandbox_pool = None
+
+
 # Helper functions
 def prepare_submission_directory(submission_id):
     work_dir = os.path.join(os.getcwd(), "submissions", f"submission_{submission_id}")
@@ -114,57 +123,83 @@ def compile_code(work_dir, filename, exec_name, language):
         return {"status": "compilation_error", "message": e.stderr.decode()}
 
 
-def execute_code_in_docker(submission_id, work_dir, run_cmd, input_file, output_file, image, timeout, memory_limit):
-    input_file_rel = os.path.relpath(input_file, work_dir)
-    output_file_rel = os.path.relpath(output_file, work_dir)
-    work_dir = os.path.join(base_dir, "submissions", f"submission_{submission_id}")
-    container_name = f"submission_{submission_id}_runner"
+def get_sandbox_pool():
+    """Returns the sandbox pool of the current process, creating it lazily so that
+    every forked Celery child gets its own containers and refill thread."""
+    global _sandbox_pool
+    if _sandbox_pool is None or _sandbox_pool.pid != os.getpid():
+        _sandbox_pool = SandboxPool(LANGUAGE_CONFIG, base_dir, metrics_client=r)
+    return _sandbox_pool
 
-    docker_cmd = [
-        "docker", "run",
-        "--rm",
-        f"--memory={memory_limit}m", "--cpus=1",
-        "--name", container_name,  # Assign a name to the container
-        "-v", f"{work_dir}:/app", "-w", "/app", image, "sh", "-c",
-        f"timeout {timeout}s {run_cmd} < {input_file_rel} > {output_file_rel} 2>&1;"
-    ]
 
-    logging.info(f"Executing Docker command: {' '.join(docker_cmd)}")
+def shutdown_sandbox_pool():
+    if _sandbox_pool is not None and _sandbox_pool.pid == os.getpid():
+        _sandbox_pool.shutdown()
 
-    try:
-        process = subprocess.Popen(docker_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-        # Wait for process to finish or timeout
-        start_time = time.time()
-        while process.poll() is None:
-            if time.time() - start_time > timeout:
-                logging.error(f"Process timeout, force stopping container: {container_name}")
-                subprocess.run(["docker", "kill", container_name], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                return {"status": "Time Limit Exceeded", "message": "Time Limit Exceeded"}
-            time.sleep(0.1)
-
-        stdout, stderr = process.communicate()
-
-        # Check for Memory Limit Exceeded (Docker exit code 137 or 'Killed' in stderr)
-        stderr_text = stderr.decode().strip()
-        if process.returncode == 137 or "Killed" in stderr_text or "Out of memory" in stderr_text:
-            return {
-                "status": "memory_limit_exceeded",
-                "message": "Memory Limit Exceeded",
-            }
-
-        if stderr_text:
-            return {
-                "status": "Runtime Error",
-                "message": stderr_text,
-            }
 
-        return {"status": "success"}
+def stage_program(work_dir, sandbox):
+    """Copies the compiled program (the top-level files of work_dir) into a leased sandbox."""
+    for name in os.listdir(work_dir):
+        path = os.path.join(work_dir, name)
+        if os.path.isfile(path):
+            shutil.copy2(path, os.path.join(sandbox.workspace, name))
+
 
+def execute_in_sandbox(sandbox, run_cmd, input_file_rel, output_file_rel, timeout):
+    """Runs a single test case inside a leased sandbox. Paths are relative to its workspace."""
+    start_time = time.time()
+    try:
+        # The in-container `timeout` enforces the limit; this one only guards against
+        # programs that ignore SIGTERM or a wedged docker daemon.
+        process = sandbox.exec(
+            f"timeout {timeout}s {run_cmd} < {input_file_rel} > {output_file_rel} 2>&1",
+            timeout=timeout + SANDBOX_EXEC_GRACE,
+        )
     except subprocess.TimeoutExpired:
-        logging.error(f"Timeout expired, force stopping container: {container_name}")
-        subprocess.run(["docker", "kill", container_name], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return {"status": "Time Limit Exceeded", "message": "Time Limit Exceeded"}
+        logging.error(f"Exec timeout, recycling sandbox: {sandbox.name}")
+        sandbox.broken = True
+        return {"status": "Time Limit Exceeded", "message": "Time Limit Exceeded",
+                "time": time.time() - start_time}
+    elapsed = time.time() - start_time
+
+    # GNU timeout exits 124, busybox timeout leaves the program killed by SIGTERM (143)
+    if process.returncode in (124, 143):
+        return {"status": "Time Limit Exceeded", "message": "Time Limit Exceeded", "time": elapsed}
+
+    stderr_text = process.stderr.decode().strip()
+    if process.returncode == 137 or "Killed" in stderr_text or "Out of memory" in stderr_text:
+        return {
+            "status": "memory_limit_exceeded",
+            "message": "Memory Limit Exceeded",
+            "time": elapsed,
+        }
+
+    if stderr_text:
+        return {
+            "status": "Runtime Error",
+            "message": stderr_text,
+            "time": elapsed,
+        }
+
+    return {"status": "success", "time": elapsed}
+
+
+def execute_code_in_docker(work_dir, language, run_cmd, input_file, output_file, timeout):
+    """Runs the program in work_dir once against input_file in a pooled sandbox."""
+    try:
+        with get_sandbox_pool().lease(language) as sandbox:
+            stage_program(work_dir, sandbox)
+            shutil.copy(input_file, os.path.join(sandbox.workspace, "input.txt"))
+
+            exec_result = execute_in_sandbox(sandbox, run_cmd, "input.txt", "output.txt", timeout)
+
+            sandbox_output = os.path.join(sandbox.workspace, "output.txt")
+            if os.path.exists(sandbox_output):
+                shutil.copy(sandbox_output, output_file)
+            return exec_result
+    except RuntimeError as e:
+        logging.error(str(e))
+        return {"status": "failed", "message": str(e)}
 
 
 def prepare_inputs_and_outputs(input_path, work_dir):
@@ -233,29 +268,18 @@ def execute_reference_solution(problemid, submission_id, work_dir, input_file):
             logging.error(
                 f"Compilation failed. Error: {compile_result.stderr.decode()}")
             return f"[Compilation Error] {compile_result.stderr.decode().strip()}"
-        # work_dir = "/home/thefallenone/online-judge-backend/submissions/submission_" + str(submission_id)
-        work_dir = os.path.join(base_dir, "submissions",
-                               f"submission_{submission_id}")
         logging.info("Compilation successful.")
         logging.info(f"Input file relative path: {input_file_relative}")
-        # Run the compiled executable inside Docker
-        docker_cmd = [
-            "docker", "run", "--rm", "-v",
-            f"{work_dir}:/app",
-            "-w",
-            "/app",
-            "gcc:latest",
-            "sh",
-            "-c",
-            f"./solution_exec < {input_file_relative}",
-        ]
-
-        logging.info(
-            f"Executing reference solution with Docker: {' '.join(docker_cmd)}")
-
-        result = subprocess.run(
-            docker_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
+        # Run the compiled executable in a pooled gcc sandbox
+        with get_sandbox_pool().lease("cpp") as sandbox:
+            stage_program(work_dir, sandbox)
+            shutil.copy(input_file, os.path.join(sandbox.workspace, "input.txt"))
+            try:
+                result = sandbox.exec("./solution_exec < input.txt", timeout=REFERENCE_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                sandbox.broken = True
+                logging.error("Reference solution timed out.")
+                return "[Runtime Error] Reference solution timed out"
 
         if result.returncode != 0:
             logging.error(
@@ -335,14 +359,12 @@ def run(submission_id, code, language, problem_id, inputData=None):
         logging.info("We are before execute_code_in_docker")
         logging.info(f"Formatted Run Command: {run_cmd}")
         exec_result = execute_code_in_docker(
-            submission_id,
             work_dir,
+            language,
             run_cmd,
             input_file,
             output_file,
-            config["image"],
             config["timeout"],
-            config["memory_limit"],
         )
         logging.info("We are after execute_code_in_docker %s",
                      exec_result["status"])
@@ -460,78 +482,88 @@ def submit(submission_id, code, language, problem_id, input_path, java_classname
             })
             return result
 
-        for i, (input_data, expected_output) in enumerate(zip(test_inputs, expected_outputs)):
-            input_file = os.path.join(work_dir, "inputs", f"input{i}.txt")
-            output_file = os.path.join(work_dir, "outputs", f"output{i}.txt")
-
-            with open(input_file, "w") as f:
-                f.write(input_data)
-
-            if language == "java":
-                run_cmd = config["run_command"].format(classname=classname)
-            elif language == "cpp":
-                run_cmd = config["run_command"].format(exec_name=exec_name)
-            else:
-                run_cmd = config["run_command"].format(filename=filename)
-
-            logging.info(f"Executing Test Case {i + 1}...")
-
-            # Run code inside Docker
-            exec_result = execute_code_in_docker(
-                submission_id,
-                work_dir,
-                run_cmd,
-                input_file,
-                output_file,
-                config["image"],
-                config["timeout"],
-                config["memory_limit"],
-            )
-
-            # If execution failed, return the error message early
-            if exec_result["status"] == "Time Limit Exceeded":
-                result.update({
-                    "status": "Time Limit Exceeded",
-                    "test_case": f"Test Case {i + 1}",
-                    "message": f"Time Limit Exceeded on Test Case {i+1}",
-                })
-                return result  # ⬅️ Stop execution immediately
+        if language == "java":
+            run_cmd = config["run_command"].format(classname=classname)
+        elif language == "cpp":
+            run_cmd = config["run_command"].format(exec_name=exec_name)
+        else:
+            run_cmd = config["run_command"].format(filename=filename)
 
-            if exec_result["status"] == "memory_limit_exceeded":
-                result.update({
-                    "status": "Memory Limit Exceeded",
-                    "test_case": f"Test Case {i + 1}",
-                    "message": f"Memory Limit Exceeded on Test Case {i+1}",
-                })
-                return result
-            if exec_result["status"] != "success":
-                result.update({
-                    "status": "failed",
-                    "test_case": f"Test Case {i + 1}",
-                    "message": f"Execution failed on Test Case {i+1}: {exec_result['message']}",
+        test_results = []
+        result["test_results"] = test_results
+
+        # One sandbox for the whole submission, every test case is streamed through it
+        with get_sandbox_pool().lease(language) as sandbox:
+            stage_program(work_dir, sandbox)
+
+            for i, (input_data, expected_output) in enumerate(zip(test_inputs, expected_outputs)):
+                input_file_rel = f"input{i}.txt"
+                output_file_rel = f"output{i}.txt"
+                output_file = os.path.join(sandbox.workspace, output_file_rel)
+
+                with open(os.path.join(sandbox.workspace, input_file_rel), "w") as f:
+                    f.write(input_data)
+
+                logging.info(f"Executing Test Case {i + 1}...")
+
+                exec_result = execute_in_sandbox(
+                    sandbox,
+                    run_cmd,
+                    input_file_rel,
+                    output_file_rel,
+                    config["timeout"],
+                )
+                test_results.append({
+                    "test_case": i + 1,
+                    "status": exec_result["status"],
+                    "time": exec_result.get("time"),
                 })
-                return result  # ⬅️ Stop execution immediately
-
-            # ✅ Ensure the output file was created before comparing outputs
-            if not os.path.exists(output_file):
-                result.update({
-                    "status": "failed",
-                    "test_case": f"Test Case {i + 1}",
-                    "message": "Output file missing. Possibly TLE or Runtime Error.",
-                })
-                return result
 
-            # ✅ Compare actual user output to expected output
-            with open(output_file, "r") as f_out:
-                user_output = f_out.read().strip()
-
-            expected = expected_output.strip()
-            if user_output != expected:
-                result.update({
-                    "test_case": f"Test Case {i + 1}",
-                    "status": f"Wrong Answer on Test Case {i + 1}"
-                })
-                return result  # ⬅️ Stop execution immediately if wrong answer
+                # If execution failed, return the error message early
+                if exec_result["status"] == "Time Limit Exceeded":
+                    result.update({
+                        "status": "Time Limit Exceeded",
+                        "test_case": f"Test Case {i + 1}",
+                        "message": f"Time Limit Exceeded on Test Case {i+1}",
+                    })
+                    return result  # ⬅️ Stop execution immediately
+
+                if exec_result["status"] == "memory_limit_exceeded":
+                    result.update({
+                        "status": "Memory Limit Exceeded",
+                        "test_case": f"Test Case {i + 1}",
+                        "message": f"Memory Limit Exceeded on Test Case {i+1}",
+                    })
+                    return result
+                if exec_result["status"] != "success":
+                    result.update({
+                        "status": "failed",
+                        "test_case": f"Test Case {i + 1}",
+                        "message": f"Execution failed on Test Case {i+1}: {exec_result['message']}",
+                    })
+                    return result  # ⬅️ Stop execution immediately
+
+                # ✅ Ensure the output file was created before comparing outputs
+                if not os.path.exists(output_file):
+                    result.update({
+                        "status": "failed",
+                        "test_case": f"Test Case {i + 1}",
+                        "message": "Output file missing. Possibly TLE or Runtime Error.",
+                    })
+                    return result
+
+                # ✅ Compare actual user output to expected output
+                with open(output_file, "r") as f_out:
+                    user_output = f_out.read().strip()
+
+                expected = expected_output.strip()
+                if user_output != expected:
+                    test_results[-1]["status"] = "wrong_answer"
+                    result.update({
+                        "test_case": f"Test Case {i + 1}",
+                        "status": f"Wrong Answer on Test Case {i + 1}"
+                    })
+                    return result  # ⬅️ Stop execution immediately if wrong answer
 
         # If all test cases pass
         return result
@@ -0,0 +1,287 @@
+import os
+import queue
+import shutil
+import socket
+import subprocess
+import threading
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+
+# ─── Configuration ─────────────────────────────────────────────────────
+
+POOL_SIZE = int(os.getenv('SANDBOX_POOL_SIZE', 2))              # idle containers kept per language
+POOL_MAX = int(os.getenv('SANDBOX_POOL_MAX', 4))                # idle + leased containers per language
+RECYCLE_AFTER = int(os.getenv('SANDBOX_RECYCLE_AFTER', 50))     # leases before a container is replaced
+HEALTHCHECK_INTERVAL = float(os.getenv('SANDBOX_HEALTHCHECK_INTERVAL', 30))
+LEASE_TIMEOUT = float(os.getenv('SANDBOX_LEASE_TIMEOUT', 30))
+SANDBOX_USER = os.getenv('SANDBOX_USER', '65534:65534')
+PIDS_LIMIT = int(os.getenv('SANDBOX_PIDS_LIMIT', 128))
+
+POOL_LABEL = "oj.sandbox_pool"
+HOST_LABEL = "oj.sandbox_host"
+METRICS_KEY = "sandbox_pool:metrics"
+
+
+class Sandbox:
+    """An idle, locked-down container with a private workspace mounted at /app."""
+
+    def __init__(self, language, name, workspace):
+        self.language = language
+        self.name = name
+        self.workspace = workspace
+        self.uses = 0
+        self.broken = False
+        self.last_checked = time.time()
+
+    def exec(self, command, timeout=None):
+        """Runs `sh -c command` inside the sandbox and returns the CompletedProcess."""
+        return subprocess.run(
+            ["docker", "exec", "-w", "/app", self.name, "sh", "-c", command],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout,
+        )
+
+
+class SandboxPool:
+    """Keeps warm sandbox containers for every language and leases them to tasks.
+
+    Containers are started once with no network, no capabilities and a read-only
+    root filesystem. After each lease the container is reset (all user processes
+    killed, workspace wiped) and put back, or replaced once it has been used
+    RECYCLE_AFTER times. A background thread keeps POOL_SIZE idle containers per
+    language and health-checks the idle ones.
+    """
+
+    def __init__(self, language_config, base_dir, metrics_client=None):
+        self.language_config = language_config
+        self.local_root = os.path.join(os.getcwd(), "sandboxes")
+        self.host_root = os.path.join(base_dir, "sandboxes")
+        self.metrics_client = metrics_client
+        self.hostname = socket.gethostname()
+        self.pid = os.getpid()
+        self.owner = f"{self.hostname}-{self.pid}"
+        self.stats = {}
+
+        self._idle = {language: queue.Queue() for language in language_config}
+        self._total = {language: 0 for language in language_config}
+        self._lock = threading.Lock()
+        self._refill = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    # ─── Leasing ───────────────────────────────────────────────────────
+
+    @contextmanager
+    def lease(self, language):
+        """Leases a sandbox for `language`; it is reset or recycled on exit."""
+        self._ensure_started()
+        start_time = time.time()
+        sandbox, hit = self._acquire(language)
+        self._record(language, leases=1, hits=int(hit), misses=int(not hit),
+                     wait_seconds=time.time() - start_time)
+        try:
+            yield sandbox
+        finally:
+            self._release(sandbox)
+
+    def _acquire(self, language):
+        idle = self._idle[language]
+        hit = True
+        deadline = time.time() + LEASE_TIMEOUT
+        while True:
+            try:
+                sandbox = idle.get_nowait()
+            except queue.Empty:
+                hit = False
+                if self._reserve(language):
+                    try:
+                        return self._create(language), hit
+                    except Exception:
+                        self._unreserve(language)
+                        raise
+                try:
+                    sandbox = idle.get(timeout=max(deadline - time.time(), 0))
+                except queue.Empty:
+                    raise RuntimeError(f"No {language} sandbox available after {LEASE_TIMEOUT}s")
+
+            if time.time() - sandbox.last_checked < HEALTHCHECK_INTERVAL or self._healthy(sandbox):
+                return sandbox, hit
+            self._destroy(sandbox)
+
+    def _release(self, sandbox):
+        sandbox.uses += 1
+        if self._stopped or sandbox.broken or sandbox.uses >= RECYCLE_AFTER or not self._reset(sandbox):
+            self._destroy(sandbox)
+            self._record(sandbox.language, recycled=1)
+            self._refill.set()
+        else:
+            self._idle[sandbox.language].put(sandbox)
+
+    # ─── Container lifecycle ───────────────────────────────────────────
+
+    def _reserve(self, language):
+        with self._lock:
+            if self._total[language] >= POOL_MAX:
+                return False
+            self._total[language] += 1
+            return True
+
+    def _unreserve(self, language):
+        with self._lock:
+            self._total[language] -= 1
+
+    def _create(self, language):
+        config = self.language_config[language]
+        name = f"oj_sandbox_{language}_{uuid.uuid4().hex[:12]}"
+        workspace = os.path.join(self.local_root, name)
+        os.makedirs(workspace, exist_ok=True)
+        os.chmod(workspace, 0o777)
+
+        docker_cmd = [
+            "docker", "run", "-d", "--rm",
+            "--name", name,
+            "--label", f"{POOL_LABEL}={self.owner}",
+            "--label", f"{HOST_LABEL}={self.hostname}",
+            f"--memory={config['memory_limit']}m", f"--memory-swap={config['memory_limit']}m",
+            "--cpus=1",
+            f"--pids-limit={PIDS_LIMIT}",
+            "--network", "none",
+            "--cap-drop", "ALL",
+            "--security-opt", "no-new-privileges",
+            "--read-only", "--tmpfs", "/tmp:rw,exec,size=64m",
+            "--user", SANDBOX_USER,
+            "-v", f"{os.path.join(self.host_root, name)}:/app", "-w", "/app",
+            config["image"], "tail", "-f", "/dev/null",
+        ]
+        result = subprocess.run(docker_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            shutil.rmtree(workspace, ignore_errors=True)
+            raise RuntimeError(f"Failed to start {language} sandbox: {result.stderr.decode().strip()}")
+
+        logging.info(f"[SandboxPool] Started {name}")
+        self._record(language, created=1)
+        return Sandbox(language, name, workspace)
+
+    def _destroy(self, sandbox):
+        subprocess.run(["docker", "rm", "-f", sandbox.name], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        shutil.rmtree(sandbox.workspace, ignore_errors=True)
+        self._unreserve(sandbox.language)
+        logging.info(f"[SandboxPool] Removed {sandbox.name}")
+
+    def _reset(self, sandbox):
+        """Kills everything the last task left running and wipes the workspace."""
+        try:
+            # PID 1 of the container ignores signals from inside its own namespace
+            result = sandbox.exec("kill -9 -1 2>/dev/null; true", timeout=5)
+        except subprocess.TimeoutExpired:
+            return False
+        if result.returncode != 0:
+            return False
+        sandbox.last_checked = time.time()
+        for entry in os.listdir(sandbox.workspace):
+            path = os.path.join(sandbox.workspace, entry)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+        return True
+
+    def _healthy(self, sandbox):
+        try:
+            ok = sandbox.exec("true", timeout=5).returncode == 0
+        except subprocess.TimeoutExpired:
+            ok = False
+        sandbox.last_checked = time.time()
+        if not ok:
+            logging.warning(f"[SandboxPool] Health check failed for {sandbox.name}")
+            self._record(sandbox.language, health_failures=1)
+        return ok
+
+    # ─── Background refill ─────────────────────────────────────────────
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._refill_loop, daemon=True)
+                    self._thread.start()
+
+    def _refill_loop(self):
+        while not self._stopped:
+            for language in self.language_config:
+                try:
+                    self._top_up(language)
+                    self._check_idle(language)
+                except Exception as e:
+                    logging.error(f"[SandboxPool] Refill failed for {language}: {e}")
+            self._refill.wait(HEALTHCHECK_INTERVAL)
+            self._refill.clear()
+
+    def _top_up(self, language):
+        while not self._stopped and self._idle[language].qsize() < POOL_SIZE and self._reserve(language):
+            try:
+                self._idle[language].put(self._create(language))
+            except Exception:
+                self._unreserve(language)
+                raise
+
+    def _check_idle(self, language):
+        idle = self._idle[language]
+        for _ in range(idle.qsize()):
+            try:
+                sandbox = idle.get_nowait()
+            except queue.Empty:
+                return
+            if time.time() - sandbox.last_checked < HEALTHCHECK_INTERVAL or self._healthy(sandbox):
+                idle.put(sandbox)
+            else:
+                self._destroy(sandbox)
+
+    def shutdown(self):
+        """Stops the refill thread and removes every idle container of this pool."""
+        self._stopped = True
+        self._refill.set()
+        for idle in self._idle.values():
+            while True:
+                try:
+                    self._destroy(idle.get_nowait())
+                except queue.Empty:
+                    break
+
+    # ─── Metrics ───────────────────────────────────────────────────────
+
+    def _record(self, language, **values):
+        with self._lock:
+            stats = self.stats.setdefault(language, {})
+            for field, value in values.items():
+                stats[field] = stats.get(field, 0) + value
+            if "wait_seconds" in values:
+                stats["wait_seconds_max"] = max(stats.get("wait_seconds_max", 0), values["wait_seconds"])
+
+        if self.metrics_client is None:
+            return
+        try:
+            pipe = self.metrics_client.pipeline(transaction=False)
+            for field, value in values.items():
+                pipe.hincrbyfloat(f"{METRICS_KEY}:{language}", field, value)
+            pipe.execute()
+        except Exception as e:
+            logging.warning(f"[SandboxPool] Failed to publish metrics: {e}")
+
+
+def sweep_stale_sandboxes(hostname=None):
+    """Removes pool containers a previous worker on this host left behind."""
+    hostname = hostname or socket.gethostname()
+    result = subprocess.run(
+        ["docker", "ps", "-a", "--format", "{{.Names}}", "--filter", f"label={HOST_LABEL}={hostname}"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    names = result.stdout.decode().split()
+    if not names:
+        return
+    subprocess.run(["docker", "rm", "-f", *names], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    local_root = os.path.join(os.getcwd(), "sandboxes")
+    for name in names:
+        shutil.rmtree(os.path.join(local_root, name), ignore_errors=True)
+    logging.info(f"[SandboxPool] Removed {len(names)} stale sandboxes")
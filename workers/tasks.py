@@ -3,8 +3,10 @@ import json
 import base64
 import requests
 from celery import Celery
+from celery.signals import worker_init, worker_process_shutdown
 from redis import Redis
-from execute_code import run, submit, runSystemcode
+from execute_code import run, submit, runSystemcode, shutdown_sandbox_pool
+from sandbox_pool import sweep_stale_sandboxes
 
 # ─── Configuration ─────────────────────────────────────────────────────
 
@@ -31,6 +33,17 @@ app.conf.update(
     task_acks_late=True,
 )
 
+# ─── Sandbox Pool Lifecycle ─────────────────────────────────────────────
+
+@worker_init.connect
+def remove_stale_sandboxes(**kwargs):
+    """Drop pool containers left behind by a previous worker on this host."""
+    sweep_stale_sandboxes()
+
+@worker_process_shutdown.connect
+def stop_sandbox_pool(**kwargs):
+    shutdown_sandbox_pool()
+
 # ─── Redis Client for Temporary Run Result Caching ─────────────────────
 
 redis_client = Redis(